@@ -1,365 +1,646 @@
-import io, math, textwrap, requests
-from PIL import Image, ImageDraw
-import streamlit as st
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from matplotlib.backends.backend_pdf import PdfPages
-
-try:
-    from streamlit_folium import st_folium
-    import folium
-    FOLIUM_OK = True
-except Exception:
-    FOLIUM_OK = False
-
-st.set_page_config(page_title="Single Site Plan — Page 1 (A3)", layout="centered")
-
-st.header("🏗️ Anantha Single Site Plan — (A3)")
-st.markdown("Enter all details below, then click **Generate A3 PDF**.")
-
-# ----------- Site Details -----------
-st.subheader("🧾 Site Details")
-survey_no = st.text_input("Survey Number (SY. NO.)")
-village = st.text_input("Village")
-taluk = st.text_input("Taluk")
-epid = st.text_input("EPID (E Khata number)")
-ward_no = st.text_input("Ward Number")
-constituency = st.text_input("Constituency Name")
-
-# ----------- Dimensions -----------
-st.subheader("📐 Plot Dimensions")
-site_length_m = st.number_input("Site Length (m)", min_value=0.1, value=15.0)
-site_width_m = st.number_input("Site Width (m)", min_value=0.1, value=12.0)
-total_builtup = st.number_input("Total Built-up Area (Sq.m)", min_value=0.0, value=0.0, step=1.0)
-
-# ----------- Roads -----------
-st.subheader("🚗 Roads Around the Site")
-road_info = {}
-for side in ["North", "South", "East", "West"]:
-    c1, c2 = st.columns([1, 1.2])
-    with c1:
-        has_road = st.checkbox(f"{side} Road", value=(side == "North"))
-    with c2:
-        width = st.number_input(f"{side} Road Width (m)", min_value=0.0,
-                                value=6.0 if has_road else 0.0, step=0.5, key=f"{side}_width")
-    road_info[side.lower()] = {"exists": has_road, "width": width}
-
-# ----------- Key Plan Map -----------
-st.subheader("🗺️ Key Plan — Click on map to set site location")
-kp_radius_m = 50
-kp_zoom = 18
-
-default_center = (12.9716, 77.5946)
-m = folium.Map(location=default_center, zoom_start=kp_zoom, control_scale=True)
-folium.TileLayer("openstreetmap").add_to(m)
-folium.LatLngPopup().add_to(m)
-
-def latlon_to_tile_xy(lat_deg, lon_deg, zoom):
-    lat_rad = math.radians(lat_deg)
-    n = 2.0 ** zoom
-    xtile = (lon_deg + 180.0) / 360.0 * n
-    ytile = (1.0 - math.log(math.tan(lat_rad) + 1 / math.cos(lat_rad)) / math.pi) / 2.0 * n
-    return xtile, ytile
-
-def fetch_tile(z, x, y):
-    url = f"https://tile.openstreetmap.org/{z}/{x}/{y}.png"
-    headers = {"User-Agent": "SingleSitePlanApp/1.0"}
-    try:
-        r = requests.get(url, headers=headers, timeout=8)
-        r.raise_for_status()
-        return Image.open(io.BytesIO(r.content)).convert("RGBA")
-    except Exception:
-        return Image.new("RGBA", (256, 256), (240, 240, 240, 255))
-
-def make_keyplan_image(lat, lon, zoom=16, radius_m=200):
-    xtile, ytile = latlon_to_tile_xy(lat, lon, zoom)
-    size = 256
-    x_c, y_c = int(xtile), int(ytile)
-    stitched = Image.new("RGBA", (3*size, 3*size))
-    for dx in range(-1, 2):
-        for dy in range(-1, 2):
-            img = fetch_tile(zoom, x_c+dx, y_c+dy)
-            stitched.paste(img, ((dx+1)*size, (dy+1)*size))
-    R = 6378137.0
-    mpp = (math.cos(math.radians(lat)) * 2 * math.pi * R) / (256 * (2**zoom))
-    radius_px = int(radius_m / mpp)
-    cx = (xtile - x_c + 1) * size
-    cy = (ytile - y_c + 1) * size
-    draw = ImageDraw.Draw(stitched)
-    draw.ellipse([cx - radius_px, cy - radius_px, cx + radius_px, cy + radius_px],
-                 outline=(200, 0, 0, 255), width=6)
-    draw.ellipse([cx - 4, cy - 4, cx + 4, cy + 4], fill=(0, 0, 0))
-    return stitched
-
-if "marker" not in st.session_state:
-    st.session_state.marker = None
-
-clicked = st_folium(m, width=700, height=400)
-if clicked and clicked.get("last_clicked"):
-    lat, lon = clicked["last_clicked"]["lat"], clicked["last_clicked"]["lng"]
-    st.session_state.marker = (lat, lon)
-picked_latlon = st.session_state.marker
-
-if picked_latlon:
-    lat, lon = picked_latlon
-    m2 = folium.Map(location=(lat, lon), zoom_start=kp_zoom, control_scale=True)
-    folium.Marker((lat, lon), tooltip="Selected Site Location").add_to(m2)
-    folium.Circle(
-        location=(lat, lon),
-        radius=kp_radius_m,
-        color="red", weight=4,
-        fill=True, fill_color="#ff0000", fill_opacity=0.05
-    ).add_to(m2)
-    st_folium(m2, width=700, height=400)
-    st.success(f"📍 Location set: {lat:.6f}, {lon:.6f}")
-
-# ----------- ADLR Sketch Upload -----------
-st.subheader("📄 ADLR Sketch (Optional)")
-adlr_file = st.file_uploader("Upload ADLR sketch image (JPG, PNG)", type=["jpg", "jpeg", "png"])
-
-# ----------- PDF Generation -----------
-if st.button("📄 Generate A3 PDF"):
-    PAGE_W_MM, PAGE_H_MM = 420.0, 297.0
-    FIG_W_IN, FIG_H_IN = PAGE_W_MM/25.4, PAGE_H_MM/25.4
-    LEFT, RIGHT, TOP, BOTTOM = 12, 12, 12, 12
-    DRAW_W = PAGE_W_MM*0.62
-    DRAW_H = PAGE_H_MM - TOP - BOTTOM
-    DRAW_X = LEFT 
-    DRAW_Y = BOTTOM
-
-    F_TITLE, F_LABEL, F_BODY, F_COND = 9.5, 8.5, 6.5, 4.5
-    LW_BORDER, LW_BOX, LW_SITE = 0.25, 0.25, 0.6
-    SCALE = 100.0
-    mm_per_m = 1000.0 / SCALE
-
-    fig = plt.figure(figsize=(FIG_W_IN, FIG_H_IN), dpi=72)
-    ax = fig.add_subplot(111)
-    ax.set_xlim(0, PAGE_W_MM); ax.set_ylim(0, PAGE_H_MM)
-    ax.set_aspect("equal"); ax.axis("off")
-
-    # Border
-    ax.add_patch(mpatches.Rectangle((LEFT/2, BOTTOM/2),
-                                    PAGE_W_MM-LEFT, PAGE_H_MM-BOTTOM,
-                                    fill=False, lw=LW_BORDER))
-
-    # Site placement
-    inner_pad = 4.0
-    usable_w = DRAW_W - 4*inner_pad; usable_h = DRAW_H - 4*inner_pad
-    mm_per_m_use = min(usable_w/site_width_m, usable_h/site_length_m)
-    site_w_mm = site_width_m*mm_per_m_use; site_h_mm = site_length_m*mm_per_m_use
-    site_x = DRAW_X + inner_pad + (usable_w - site_w_mm)/2
-    site_y = DRAW_Y + inner_pad + (usable_h - site_h_mm)/2
-
-    # Site rectangle
-    ax.add_patch(
-        mpatches.Rectangle(
-            (site_x, site_y), site_w_mm, site_h_mm,
-            fill=False, lw=LW_SITE, linestyle=(0, (16,5,4,5,4,5))
-        )
-    )
-
-    # Roads
-    for side, info in road_info.items():
-        if not info["exists"]: continue
-        w_m = info["width"]
-        road_band = w_m * mm_per_m
-        if side == "north":
-            rx, ry, rw, rh = site_x, site_y + site_h_mm, site_w_mm, road_band
-            rot, txtx, txty = 0, rx+rw/2, ry+rh/2
-        elif side == "south":
-            rx, ry, rw, rh = site_x, site_y - road_band, site_w_mm, road_band
-            rot, txtx, txty = 0, rx+rw/2, ry+rh/2
-        elif side == "east":
-            rx, ry, rw, rh = site_x + site_w_mm, site_y, road_band, site_h_mm
-            rot, txtx, txty = 90, rx+rw/2, ry+rh/2
-        elif side == "west":
-            rx, ry, rw, rh = site_x - road_band, site_y, road_band, site_h_mm
-            rot, txtx, txty = 90, rx+rw/2, ry+rh/2
-        ax.add_patch(
-            mpatches.Rectangle((rx, ry), rw, rh, facecolor="#e0e0e0",
-                               edgecolor="black", lw=0.4, hatch="////")
-        )
-        label_offset = 3 * (1000.0 / SCALE)
-        if side == "north": txty += road_band/2 + label_offset
-        elif side == "south": txty -= road_band/2 + label_offset
-        elif side == "east": txtx += road_band/2 + label_offset
-        elif side == "west": txtx -= road_band/2 + label_offset
-        ax.text(txtx, txty,
-                f"{side.title()} ({w_m:.1f} m ROAD)",
-                ha="center", va="center", fontsize=F_BODY, rotation=rot)
-
-    # Site label
-    ax.text(site_x + site_w_mm/2, site_y + site_h_mm + 30,
-            f"SITE (SY.NO. {survey_no})",
-            ha="center", va="bottom", fontsize=F_TITLE, weight="bold")
-
-    # ---------- RIGHT COLUMN ----------
-    INFO_X = DRAW_X + DRAW_W + 15
-
-    # --- KEY PLAN ---
-    key_x, key_y, key_w, key_h = INFO_X, PAGE_H_MM - 75, 110, 70
-    ax.add_patch(mpatches.Rectangle((key_x, key_y), key_w, key_h, fill=False, lw=0.25))
-    ax.text(key_x + key_w/2, key_y + key_h + 4, "KEY PLAN (NOT TO SCALE)",
-            ha="center", va="bottom", fontsize=F_LABEL, weight="bold")
-
-    if picked_latlon:
-        try:
-            lat, lon = picked_latlon
-            kimg = make_keyplan_image(lat, lon, zoom=kp_zoom, radius_m=kp_radius_m)
-            kimg = kimg.resize((int(key_w*5), int(key_h*5)), Image.LANCZOS)
-            ax.imshow(kimg, extent=(key_x+1, key_x+key_w-1, key_y+1, key_y+key_h-1))
-        except Exception:
-            ax.text(key_x + key_w/2, key_y + key_h/2,
-                "Key Plan (Error loading map)", ha="center", va="center",
-                fontsize=F_BODY, style="italic", color="red")
-    else:
-        ax.text(key_x + key_w/2, key_y + key_h/2,
-            "KEY PLAN (To be inserted here)",
-            ha="center", va="center", fontsize=F_BODY, style="italic", color="gray")
-
-       
-
-    # North arrow
-    na_x = key_x + key_w - 8; na_y = key_y + key_h - 18
-    ax.arrow(na_x, na_y, 0, 10, head_width=3, head_length=4, fc="black", ec="black", lw=0.6)
-    ax.text(na_x, na_y + 12, "N", ha="center", va="bottom", fontsize=F_LABEL, weight="bold")
-
-    # --- ADLR SKETCH ---
-    adlr_x, adlr_y, adlr_w, adlr_h = INFO_X, key_y - 75, 110, 65
-    ax.add_patch(mpatches.Rectangle((adlr_x, adlr_y), adlr_w, adlr_h, fill=False, lw=0.25))
-    ax.text(adlr_x + adlr_w/2, adlr_y + adlr_h + 4,
-            "ADLR SKETCH SHOWING THE LOCATION OF THE PROPOSED SITE WITHIN THE SURVEY NUMBER",
-            ha="center", va="bottom", fontsize=F_COND, weight="bold")
-    if adlr_file:
-        adlr_img = Image.open(adlr_file).convert("RGB")
-        adlr_img.thumbnail((adlr_w*5, adlr_h*5))
-        ax.imshow(adlr_img, extent=(adlr_x+1, adlr_x+adlr_w-1, adlr_y+1, adlr_y+adlr_h-1))
-    else:
-        ax.text(adlr_x + adlr_w/2, adlr_y + adlr_h/2,
-                "ADLR SKETCH (To be inserted here)", ha="center", va="center",
-                fontsize=F_BODY, style="italic", color="gray")
-
-    # --- LAND USE ANALYSIS ---
-    lut_x, lut_y = INFO_X, adlr_y 
-    ax.text(lut_x + 40, lut_y + 15, "LAND USE ANALYSIS",
-            ha="center", va="bottom", fontsize=F_LABEL, weight="bold")
-    headers = ["SL.No", "PARTICULARS", "AREA (Sq.m)", "%"]
-    col_w = [12, 55, 30, 20]
-    row_h = 6.5
-    tbl_x, tbl_y = lut_x, lut_y
-    xcur = tbl_x
-    for i, h in enumerate(headers):
-        ax.text(xcur + col_w[i]/2, tbl_y, h,
-                ha="center", va="bottom", fontsize=F_COND, weight="bold")
-        xcur += col_w[i]
-    rows = [
-        ["1", "SITE AREA", f"{site_width_m*site_length_m:.1f}", "100.00"],
-        ["2", "TOTAL SITE AREA", f"{site_width_m*site_length_m:.1f}", "100.00"]
-    ]
-    for r_idx, row in enumerate(rows):
-        y = tbl_y - (r_idx + 1)*row_h
-        xcur = tbl_x
-        for i, val in enumerate(row):
-            ax.text(xcur + col_w[i]/2, y, val, ha="center", va="top", fontsize=F_COND)
-            xcur += col_w[i]
-    ax.add_patch(mpatches.Rectangle(
-        (tbl_x - 1.5, tbl_y - (len(rows)+1)*row_h),
-        sum(col_w)+3, (len(rows)+1.2)*row_h, fill=False, lw=0.25))
-
-    # --- GENERAL CONDITIONS + NOTE ---
-    GENERAL_CONDITIONS = [
-        "1. The single plot layout plan is approved based on the survey sketch certified by the Assistant Director of Land Records.",
-        "2. Building construction shall be undertaken only after obtaining approval for the building plan from the city corporation as per the approved single site layout plan.",
-        "3. The existing width of road abutting the site in question is marked in the plan. At the time of building plan approval the authority approving the building plan shall allow the maximum FAR permissible considering the minimum width of the road at any stretch towards any one side which shall join a road of equal or higher width.",
-        "4. The owner shall provide drinking water, waste water discharge system and drainage system for the site in question. During the building plan approval the owner shall submit a design to implement the rain water harvesting to collect the rain water from the entire site area.",
-        "5. Approval of single site layout plan shall not be a document to claim title to the property. In case of pending cases under the Land Reforms Act/Section 136(3) of the Land Revenue Act, 1964, approval of single site layout plan shall be subject to final order. The applicant shall be bound by the final order of the court in this regard and in no case the fees paid for the approval of the single site layout plan will be refunded.",
-        "6. If it is found that the land proposed by the applicant includes any land belonging to the Government or any other private land, in such a case, the Authority reserves the rights to modify the single site layout plan or to withdraw the plan.",
-        "7. If it is proved that the applicant has provided any false documents or forged documents for the plan sanction, the plan sanction shall stand canceled automatically.",
-        "8. The applicant shall be bound to all subsequent orders and the decision relating to payment of fees as required by the Authority.",
-        "9. Adequate provisions shall be made to segregate wet waste, dry waste and plastics. Area should be reserved for composting of wet waste, dry waste etc.",
-        "10. No Objection Certificates/Approvals for the building plan should be obtained from the competent authorities prior to construction of building on the approved single site.",
-        "11. Sewage shall not be discharged into open spaces/vacant areas but should be reused for gardening, cleaning of common areas and various other uses.",
-        "12. If the owner wishes to modify the single site layout approval to multi-plot residential layout, the owner shall submit a request to the Greater Bengaluru Authority and obtain approval for the multi-plot residential layout plan as per the zoning regulations.",
-        "13. One tree for every 240.0 sq.m of the total floor area shall be planted and nurtured at the site in question.",
-        "14. Prior permission should be obtained from the competent authority before constructing a culvert on the storm water drain between the land in question and the existing road attached to it if any.",
-        "15. To abide by such other conditions as may be imposed by the Authority from time to time."
-    ]
-
-    NOTE_TEXT = [
-        "1. The single plot plan is issued under the provisions of section 17 of KTCP Act 1961.",
-        "2. The applicant has remitted fees of Rs.******* vide challan No. ********* Dated : **.**.****.",
-        "3. The applicant has to abide by the conditions imposed in the single plot plan approval order.",
-        "4. This single plot plan is issued vide number ***/***/***-******* dated : **.**.****."
-    ]
-
-    gc_x, gc_y_top = INFO_X, lut_y
-    ax.text(gc_x, gc_y_top, "GENERAL CONDITIONS OF APPROVAL",
-            ha="left", va="bottom", fontsize=4)
-    cond_y = gc_y_top
-    for cond in GENERAL_CONDITIONS:
-        wrapped = textwrap.fill(cond, width=60)
-        ax.text(gc_x, cond_y, wrapped, ha="left", va="top", fontsize=4)
-        cond_y -= 8.0
-
-    note_y = cond_y 
-    ax.text(gc_x, note_y, "NOTE", fontsize=F_LABEL, weight="bold")
-    for i, note in enumerate(NOTE_TEXT):
-        ax.text(gc_x, note_y - (i + 1)*4.0, note, fontsize=F_COND, ha="left")
-
-    # --- TITLE BLOCK ---
-    tb_x, tb_y, tb_w, tb_h = LEFT, BOTTOM, PAGE_W_MM - LEFT - RIGHT, 35
-    ax.add_patch(mpatches.Rectangle((tb_x, tb_y), tb_w, tb_h, fill=False, lw=LW_BOX))
-    dv1, dv2 = tb_x + tb_w*0.48, tb_x + tb_w*0.70
-    ax.plot([dv1,dv1],[tb_y,tb_y+tb_h],lw=0.25,color="black")
-    ax.plot([dv2,dv2],[tb_y,tb_y+tb_h],lw=0.25,color="black")
-    ax.text(tb_x+6, tb_y+tb_h-7, "DRAWING TITLE : SINGLE SITE LAYOUT PLAN", fontsize=F_LABEL, weight="bold")
-    ax.text(tb_x+6, tb_y+tb_h-13, f"SCALE : 1:{int(SCALE)}", fontsize=F_COND)
-    ax.text(tb_x+6, tb_y+tb_h-19, f"TOTAL BUILT-UP AREA : {total_builtup:.2f} Sq.m", fontsize=F_COND)
-    ax.text(tb_x+6, tb_y+tb_h-25, f"SY. NO. : {survey_no}", fontsize=F_COND)
-    ax.text(dv1+6, tb_y+tb_h-7, f"VILLAGE : {village}", fontsize=F_COND)
-    ax.text(dv1+6, tb_y+tb_h-13, f"TALUK : {taluk}", fontsize=F_COND)
-    ax.text(dv1+6, tb_y+tb_h-19, f"EPID : {epid}", fontsize=F_COND)
-    ax.text(dv2+6, tb_y+tb_h-25, f"WARD NO. : {ward_no}    CONSTITUENCY : {constituency}", fontsize=F_COND)
-    ax.text(PAGE_W_MM-RIGHT-4, tb_y+3, "All Dimensions in metres.", fontsize=F_COND, ha="right")
-    ax.text(PAGE_W_MM - RIGHT - 4, tb_y - 5,
-            "Prepared by Anantha (Ankusha Project)", fontsize=F_COND, ha="right", style="italic")
-
-    # --- Export PDF ---
-    pdf_buf = io.BytesIO()
-    with PdfPages(pdf_buf) as pdf:
-        pdf.savefig(fig, bbox_inches="tight", orientation="landscape", dpi=1200)
-    pdf_buf.seek(0)
-
-    st.download_button("⬇️ Download A3 PDF", data=pdf_buf,
-                       file_name=f"Single_Site_{survey_no or 'site'}.pdf",
-                       mime="application/pdf")
-    st.pyplot(fig)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+import atexit, base64, io, math, os, pickle, re, threading, time, requests
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter, Retry
+from PIL import Image
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+def _mpl():
+    """Import matplotlib on first use.
+
+    Pulling in pyplot costs a few hundred milliseconds and is only needed
+    once the user actually generates a PDF, so keep it off the script-rerun
+    path that fires on every widget interaction.
+    """
+    import matplotlib
+    matplotlib.use("Agg")  # headless server; skip any GUI backend probing
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as mpatches
+    return plt, mpatches
+
+
+def _mpl_collections():
+    from matplotlib.collections import LineCollection, PatchCollection
+    return LineCollection, PatchCollection
+
+try:
+    from streamlit_folium import st_folium
+    import folium
+    FOLIUM_OK = True
+except Exception:
+    FOLIUM_OK = False
+
+st.set_page_config(page_title="Single Site Plan — Page 1 (A3)", layout="centered")
+
+st.header("🏗️ Anantha Single Site Plan — (A3)")
+st.markdown("Enter all details below, then click **Generate A3 PDF**.")
+
+# ----------- Site Details -----------
+st.subheader("🧾 Site Details")
+survey_no = st.text_input("Survey Number (SY. NO.)")
+village = st.text_input("Village")
+taluk = st.text_input("Taluk")
+epid = st.text_input("EPID (E Khata number)")
+ward_no = st.text_input("Ward Number")
+constituency = st.text_input("Constituency Name")
+
+# ----------- Dimensions -----------
+st.subheader("📐 Plot Dimensions")
+site_length_m = st.number_input("Site Length (m)", min_value=0.1, value=15.0)
+site_width_m = st.number_input("Site Width (m)", min_value=0.1, value=12.0)
+total_builtup = st.number_input("Total Built-up Area (Sq.m)", min_value=0.0, value=0.0, step=1.0)
+
+# ----------- Roads -----------
+st.subheader("🚗 Roads Around the Site")
+road_info = {}
+for side in ["North", "South", "East", "West"]:
+    c1, c2 = st.columns([1, 1.2])
+    with c1:
+        has_road = st.checkbox(f"{side} Road", value=(side == "North"))
+    with c2:
+        width = st.number_input(f"{side} Road Width (m)", min_value=0.0,
+                                value=6.0 if has_road else 0.0, step=0.5, key=f"{side}_width")
+    road_info[side.lower()] = {"exists": has_road, "width": width}
+
+# ----------- Key Plan Map -----------
+st.subheader("🗺️ Key Plan — Click on map to set site location")
+kp_radius_m = 50
+kp_zoom = 18
+
+default_center = (12.9716, 77.5946)
+
+# Folium maps are rebuilt (and their HTML re-templated) on every script
+# rerun otherwise; the objects are render-only, so share them across
+# reruns and sessions.
+@st.cache_resource(show_spinner=False)
+def _picker_map():
+    m = folium.Map(location=default_center, zoom_start=kp_zoom, control_scale=True)
+    folium.TileLayer("openstreetmap").add_to(m)
+    folium.LatLngPopup().add_to(m)
+    return m
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _confirm_map(lat, lon):
+    m2 = folium.Map(location=(lat, lon), zoom_start=kp_zoom, control_scale=True)
+    folium.Marker((lat, lon), tooltip="Selected Site Location").add_to(m2)
+    folium.Circle(
+        location=(lat, lon),
+        radius=kp_radius_m,
+        color="red", weight=4,
+        fill=True, fill_color="#ff0000", fill_opacity=0.05
+    ).add_to(m2)
+    return m2
+
+# lru_cache: the same rounded (lat, lon, zoom) recurs on every rerun
+# after a pick, and both helpers are pure.
+@lru_cache(maxsize=256)
+def latlon_to_tile_xy(lat_deg, lon_deg, zoom):
+    lat_rad = math.radians(lat_deg)
+    n = float(1 << zoom)
+    xtile = (lon_deg + 180.0) / 360.0 * n
+    # asinh(tan(lat)) is the closed form of log(tan + sec) and avoids
+    # the cancellation of the two-term expression near the poles.
+    ytile = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return xtile, ytile
+
+# Web-Mercator ground resolution of one pixel at the equator, zoom 0.
+_MPP_EQUATOR_Z0 = 2 * math.pi * 6378137.0 / 256
+
+@lru_cache(maxsize=256)
+def meters_per_pixel(lat_deg, zoom):
+    return math.cos(math.radians(lat_deg)) * _MPP_EQUATOR_Z0 / (1 << zoom)
+
+# One long-lived session so the parallel tile fetches reuse TCP/TLS
+# connections instead of handshaking per request.
+_SESSION = requests.Session()
+_SESSION.headers["User-Agent"] = "SingleSitePlanApp/1.0"
+# Retry covers connection drops and transient 5xx from the tile CDN;
+# 4xx (bad tile coords, policy blocks) still fail straight through to
+# the negative cache.
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.2,
+                      status_forcelist=[500, 502, 503, 504],
+                      allowed_methods=["GET"])))
+atexit.register(_SESSION.close)
+
+# Failures raise and so are never stored by st.cache_data; remember them
+# here briefly instead, so a dead or rate-limiting tile server is not
+# re-hit nine times on every rerun.
+_TILE_NEG = {}
+_TILE_NEG_TTL = 300
+
+# OSM's tile usage policy caps downloads at two parallel threads;
+# overridable for self-hosted tile servers.
+_TILE_WORKERS = int(os.environ.get("OSM_TILE_WORKERS", "2"))
+
+# On-disk tile store shared across server restarts (st.cache_data only
+# lives as long as the process). Entries older than the in-memory TTL
+# are refetched.
+_TILE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "site_plan_tiles")
+
+@st.cache_data(show_spinner=False, ttl=7*86400, max_entries=4096)
+def fetch_tile(z, x, y):
+    path = os.path.join(_TILE_DIR, str(z), str(x), f"{y}.png")
+    try:
+        if time.time() - os.path.getmtime(path) < 7*86400:
+            with open(path, "rb") as f:
+                return f.read()
+    except OSError:
+        pass
+    if _TILE_NEG.get((z, x, y), 0) > time.time():
+        raise RuntimeError(f"tile {z}/{x}/{y} recently failed")
+    url = f"https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+    try:
+        # Raw PNG bytes: cheap for the cache to hash and pickle.
+        r = _SESSION.get(url, timeout=8)
+        r.raise_for_status()
+    except Exception:
+        _TILE_NEG[(z, x, y)] = time.time() + _TILE_NEG_TTL
+        raise
+    _TILE_NEG.pop((z, x, y), None)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(r.content)
+        os.replace(tmp, path)  # atomic; concurrent workers can't torn-write
+    except OSError:
+        pass  # disk cache is best-effort
+    return r.content
+
+@st.cache_data(show_spinner=False, ttl=86400, max_entries=64)
+def make_keyplan_image(lat, lon, zoom=16):
+    xtile, ytile = latlon_to_tile_xy(lat, lon, zoom)
+    size = 256
+    x_c, y_c = int(xtile), int(ytile)
+    # Tile ring around the centre, addressed vectorially so a larger
+    # ring needs no extra Python looping.
+    ring = 1
+    cols = 2*ring + 1
+    dxs, dys = (d.ravel() for d in np.meshgrid(np.arange(-ring, ring+1),
+                                               np.arange(-ring, ring+1)))
+    xs, ys = x_c + dxs, y_c + dys
+    ctx = get_script_run_ctx()
+
+    def _fetch(i):
+        # Worker threads need the script-run context for st.cache_data.
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            return Image.open(io.BytesIO(fetch_tile(zoom, int(xs[i]), int(ys[i])))).convert("RGB")
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(len(xs), _TILE_WORKERS)) as ex:
+        tiles = list(ex.map(_fetch, range(len(xs))))
+    if any(t is None for t in tiles):
+        # Same failure design as fetch_tile: raise so st.cache_data never
+        # stores a stitch with grey holes for the full TTL; the caller
+        # degrades for this render only and retries next time.
+        raise RuntimeError("key plan incomplete: one or more tiles failed")
+    # Blit each tile straight into one preallocated canvas instead of
+    # pasting PIL images. RGB only: nothing downstream needs alpha (the
+    # marker is vector), so skip materialising an opaque channel per tile.
+    canvas = np.empty((cols*size, cols*size, 3), dtype=np.uint8)
+    for dx, dy, img in zip(dxs, dys, tiles):
+        canvas[(dy+ring)*size:(dy+ring+1)*size,
+               (dx+ring)*size:(dx+ring+1)*size] = np.asarray(img)
+    # Quantize to a small palette: OSM tiles have few distinct colours,
+    # so the low-entropy bitmap flate-compresses far better inside the
+    # PDF. The site marker is drawn as a vector overlay in build_pdf,
+    # keeping the cached image pure basemap.
+    quant = Image.fromarray(canvas).quantize(colors=128)
+    return np.asarray(quant.convert("RGB"))
+
+def keyplan_marker(lat, lon, zoom, radius_m):
+    """Fractional (x, y, r) of the site marker within the stitched 3x3
+    key-plan image, measured from its top-left corner."""
+    xtile, ytile = latlon_to_tile_xy(lat, lon, zoom)
+    fx = (xtile - int(xtile) + 1) / 3.0
+    fy = (ytile - int(ytile) + 1) / 3.0
+    fr = (radius_m / meters_per_pixel(lat, zoom)) / (3 * 256)
+    return fx, fy, fr
+
+if "marker" not in st.session_state:
+    st.session_state.marker = None
+
+# Only the click position needs to round-trip; returning the full map
+# state (bounds, zoom, every object) would force a rerun per pan.
+clicked = st_folium(_picker_map(), width=700, height=400,
+                    returned_objects=["last_clicked"], key="site_picker")
+if clicked and clicked.get("last_clicked"):
+    # ~1 m resolution: full float64 click jitter would produce a fresh
+    # cache key (and a fresh tile stitch / PDF) for the same spot.
+    st.session_state.marker = (round(clicked["last_clicked"]["lat"], 5),
+                               round(clicked["last_clicked"]["lng"], 5))
+picked_latlon = st.session_state.marker
+
+if picked_latlon:
+    lat, lon = picked_latlon
+    st_folium(_confirm_map(lat, lon), width=700, height=400,
+              returned_objects=[], key="site_confirm")
+    st.success(f"📍 Location set: {lat:.6f}, {lon:.6f}")
+
+# ----------- ADLR Sketch Upload -----------
+st.subheader("📄 ADLR Sketch (Optional)")
+adlr_file = st.file_uploader("Upload ADLR sketch image (JPG, PNG)", type=["jpg", "jpeg", "png"])
+
+# ----------- Static sheet text -----------
+GENERAL_CONDITIONS = [
+    "1. The single plot layout plan is approved based on the survey sketch certified by the Assistant Director of Land Records.",
+    "2. Building construction shall be undertaken only after obtaining approval for the building plan from the city corporation as per the approved single site layout plan.",
+    "3. The existing width of road abutting the site in question is marked in the plan. At the time of building plan approval the authority approving the building plan shall allow the maximum FAR permissible considering the minimum width of the road at any stretch towards any one side which shall join a road of equal or higher width.",
+    "4. The owner shall provide drinking water, waste water discharge system and drainage system for the site in question. During the building plan approval the owner shall submit a design to implement the rain water harvesting to collect the rain water from the entire site area.",
+    "5. Approval of single site layout plan shall not be a document to claim title to the property. In case of pending cases under the Land Reforms Act/Section 136(3) of the Land Revenue Act, 1964, approval of single site layout plan shall be subject to final order. The applicant shall be bound by the final order of the court in this regard and in no case the fees paid for the approval of the single site layout plan will be refunded.",
+    "6. If it is found that the land proposed by the applicant includes any land belonging to the Government or any other private land, in such a case, the Authority reserves the rights to modify the single site layout plan or to withdraw the plan.",
+    "7. If it is proved that the applicant has provided any false documents or forged documents for the plan sanction, the plan sanction shall stand canceled automatically.",
+    "8. The applicant shall be bound to all subsequent orders and the decision relating to payment of fees as required by the Authority.",
+    "9. Adequate provisions shall be made to segregate wet waste, dry waste and plastics. Area should be reserved for composting of wet waste, dry waste etc.",
+    "10. No Objection Certificates/Approvals for the building plan should be obtained from the competent authorities prior to construction of building on the approved single site.",
+    "11. Sewage shall not be discharged into open spaces/vacant areas but should be reused for gardening, cleaning of common areas and various other uses.",
+    "12. If the owner wishes to modify the single site layout approval to multi-plot residential layout, the owner shall submit a request to the Greater Bengaluru Authority and obtain approval for the multi-plot residential layout plan as per the zoning regulations.",
+    "13. One tree for every 240.0 sq.m of the total floor area shall be planted and nurtured at the site in question.",
+    "14. Prior permission should be obtained from the competent authority before constructing a culvert on the storm water drain between the land in question and the existing road attached to it if any.",
+    "15. To abide by such other conditions as may be imposed by the Authority from time to time."
+]
+
+NOTE_TEXT = [
+    "1. The single plot plan is issued under the provisions of section 17 of KTCP Act 1961.",
+    "2. The applicant has remitted fees of Rs.******* vide challan No. ********* Dated : **.**.****.",
+    "3. The applicant has to abide by the conditions imposed in the single plot plan approval order.",
+    "4. This single plot plan is issued vide number ***/***/***-******* dated : **.**.****."
+]
+
+# Wrapped once at import; the conditions never change between renders.
+# textwrap.fill re-tokenises with several regexes per call; a single
+# precompiled greedy-chunk pattern does the same job for this plain text.
+_WRAP60 = re.compile(r"(.{1,60})(?:\s+|$)")
+
+GENERAL_CONDITIONS_WRAPPED = ["\n".join(_WRAP60.findall(c)) for c in GENERAL_CONDITIONS]
+GENERAL_CONDITIONS_BODY = "\n\n".join(GENERAL_CONDITIONS_WRAPPED)
+NOTE_BODY = "\n".join(NOTE_TEXT)
+
+# ----------- A3 sheet layout -----------
+PAGE_W_MM, PAGE_H_MM = 420.0, 297.0
+FIG_W_IN, FIG_H_IN = PAGE_W_MM/25.4, PAGE_H_MM/25.4
+LEFT, RIGHT, TOP, BOTTOM = 12, 12, 12, 12
+
+tb_x, tb_y, tb_w, tb_h = LEFT, BOTTOM, PAGE_W_MM - LEFT - RIGHT, 35
+dv1, dv2 = tb_x + tb_w*0.48, tb_x + tb_w*0.70
+
+DRAW_W = PAGE_W_MM*0.62
+DRAW_X = LEFT
+# Keep the plot clear of the title block now that the page is exact A3.
+DRAW_Y = tb_y + tb_h + 4
+DRAW_H = PAGE_H_MM - TOP - DRAW_Y
+INNER_PAD = 4.0
+USABLE_W = DRAW_W - 4*INNER_PAD
+USABLE_H = DRAW_H - 4*INNER_PAD
+LABEL_ALLOW = 8.0   # room reserved beside a road band for its label
+LABEL_OFFSET = 4.0  # label centre distance outside the band edge
+
+F_TITLE, F_LABEL, F_BODY, F_COND = 9.5, 8.5, 6.5, 4.5
+LW_BOX, LW_SITE = 0.25, 0.6
+SCALE = 100.0
+mm_per_m = 1000.0 / SCALE
+
+INFO_X = DRAW_X + DRAW_W + 15
+key_x, key_y, key_w, key_h = INFO_X, PAGE_H_MM - 75, 110, 70
+adlr_x, adlr_y, adlr_w, adlr_h = INFO_X, key_y - 75, 110, 65
+lut_x, lut_y = INFO_X, adlr_y
+headers = ["SL.No", "PARTICULARS", "AREA (Sq.m)", "%"]
+col_w = [12, 55, 30, 20]
+row_h = 6.5
+tbl_x, tbl_y = lut_x, lut_y
+
+@lru_cache(maxsize=64)
+def _fit_site(site_length_m, site_width_m, roads):
+    """Place the site rectangle inside the drawing area, in page mm.
+
+    The page no longer grows to absorb overflow (the tight-bbox pass is
+    gone), so room is reserved for the road bands, their labels and the
+    site caption. Pure in its hashable arguments, hence the lru_cache:
+    a rerun with unchanged dimensions skips the whole fit.
+    """
+    band = {side: (w_m * mm_per_m if has_road else 0.0)
+            for side, has_road, w_m in roads}
+    pad_n, pad_s, pad_e, pad_w = (
+        band.get(s, 0.0) + (LABEL_ALLOW if band.get(s) else 0.0)
+        for s in ("north", "south", "east", "west"))
+    mm_per_m_use = min((USABLE_W - pad_e - pad_w)/site_width_m,
+                       (USABLE_H - pad_n - pad_s)/site_length_m)
+    site_w_mm = site_width_m*mm_per_m_use; site_h_mm = site_length_m*mm_per_m_use
+    site_x = DRAW_X + INNER_PAD + pad_w + (USABLE_W - pad_w - pad_e - site_w_mm)/2
+    site_y = DRAW_Y + INNER_PAD + pad_s + (USABLE_H - pad_s - pad_n - site_h_mm)/2
+    return site_x, site_y, site_w_mm, site_h_mm
+
+# ----------- PDF Generation -----------
+@st.cache_resource(show_spinner=False)
+def _template_figure():
+    """Build the input-independent A3 chrome once and return it pickled.
+
+    Everything drawn here is identical for every generated sheet: page
+    border, key plan / ADLR boxes and their labels, north arrow, table
+    headers and frame, general conditions, notes and the title block
+    frame. build_pdf unpickles a fresh copy per render and adds only the
+    dynamic layer, so ~70% of the artists are never rebuilt.
+    """
+    plt, mpatches = _mpl()
+    fig = plt.figure(figsize=(FIG_W_IN, FIG_H_IN), dpi=72)
+    ax = fig.add_subplot(111)
+    # Fill the page exactly: one data unit == one millimetre on paper,
+    # so no tight-bbox pass is needed at save time.
+    ax.set_position([0, 0, 1, 1])
+    ax.set_xlim(0, PAGE_W_MM); ax.set_ylim(0, PAGE_H_MM)
+    ax.set_aspect("equal"); ax.axis("off")
+
+    LineCollection, PatchCollection = _mpl_collections()
+
+    # All static frames (page border, key plan, ADLR, title block) in one
+    # collection: one artist to transform and one PDF graphics state
+    # instead of four.
+    frames = [
+        mpatches.Rectangle((LEFT/2, BOTTOM/2), PAGE_W_MM-LEFT, PAGE_H_MM-BOTTOM),
+        mpatches.Rectangle((key_x, key_y), key_w, key_h),
+        mpatches.Rectangle((adlr_x, adlr_y), adlr_w, adlr_h),
+        mpatches.Rectangle((tb_x, tb_y), tb_w, tb_h),
+    ]
+    ax.add_collection(PatchCollection(frames, facecolor="none",
+                                      edgecolor="black", lw=LW_BOX))
+
+    # --- KEY PLAN box ---
+    ax.text(key_x + key_w/2, key_y + key_h + 1, "KEY PLAN (NOT TO SCALE)",
+            ha="center", va="bottom", fontsize=F_LABEL, weight="bold")
+
+    # North arrow
+    na_x = key_x + key_w - 8; na_y = key_y + key_h - 18
+    ax.arrow(na_x, na_y, 0, 10, head_width=3, head_length=4, fc="black", ec="black", lw=0.6)
+    ax.text(na_x, na_y + 12, "N", ha="center", va="bottom", fontsize=F_LABEL, weight="bold")
+
+    # --- ADLR SKETCH box ---
+    ax.text(adlr_x + adlr_w/2, adlr_y + adlr_h + 4,
+            "ADLR SKETCH SHOWING THE LOCATION OF THE PROPOSED SITE WITHIN THE SURVEY NUMBER",
+            ha="center", va="bottom", fontsize=F_COND, weight="bold")
+
+    # --- LAND USE ANALYSIS title (the table itself is dynamic) ---
+    ax.text(lut_x + 40, lut_y + 15, "LAND USE ANALYSIS",
+            ha="center", va="bottom", fontsize=F_LABEL, weight="bold")
+
+    # --- GENERAL CONDITIONS + NOTE ---
+    gc_x, gc_y_top = INFO_X, lut_y
+    ax.text(gc_x, gc_y_top, "GENERAL CONDITIONS OF APPROVAL",
+            ha="left", va="bottom", fontsize=4)
+    # One Text artist (one shaping pass, one PDF text object) for all 15
+    # conditions instead of 15.
+    gc_text = ax.text(gc_x, gc_y_top, GENERAL_CONDITIONS_BODY, ha="left", va="top",
+                      fontsize=4, linespacing=1.15)
+
+    # Place the NOTE below the measured extent of the conditions block.
+    gc_bbox = gc_text.get_window_extent(fig.canvas.get_renderer())
+    gc_bottom = ax.transData.inverted().transform((0, gc_bbox.y0))[1]
+    note_y = gc_bottom - 6.0
+    ax.text(gc_x, note_y, "NOTE", fontsize=F_LABEL, weight="bold")
+    ax.text(gc_x, note_y - 4.0, NOTE_BODY, fontsize=F_COND, ha="left", va="top",
+            linespacing=1.6)
+
+    # --- TITLE BLOCK static labels (frame is in the collection above) ---
+    ax.add_collection(LineCollection([[(dv1, tb_y), (dv1, tb_y+tb_h)],
+                                      [(dv2, tb_y), (dv2, tb_y+tb_h)]],
+                                     colors="black", lw=0.25))
+    ax.text(tb_x+6, tb_y+tb_h-7, "DRAWING TITLE : SINGLE SITE LAYOUT PLAN", fontsize=F_LABEL, weight="bold")
+    ax.text(tb_x+6, tb_y+tb_h-13, f"SCALE : 1:{int(SCALE)}", fontsize=F_COND)
+    ax.text(PAGE_W_MM-RIGHT-4, tb_y+3, "All Dimensions in metres.", fontsize=F_COND, ha="right")
+    ax.text(PAGE_W_MM - RIGHT - 4, tb_y - 5,
+            "Prepared by Anantha (Ankusha Project)", fontsize=F_COND, ha="right", style="italic")
+
+    data = pickle.dumps(fig)
+    plt.close(fig)
+    return data
+
+class _KeyplanIncomplete(Exception):
+    """Raised by build_pdf so a sheet rendered with a failed key plan is
+    never stored in the cache; carries the degraded PDF bytes."""
+
+    def __init__(self, pdf):
+        super().__init__("key plan incomplete")
+        self.pdf = pdf
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_pdf(survey_no, village, taluk, epid, ward_no, constituency,
+              site_length_m, site_width_m, total_builtup,
+              roads, picked_latlon, adlr_bytes):
+    """Render the full A3 sheet and return the PDF bytes.
+
+    All arguments are plain hashable values so identical inputs return
+    the cached result without redrawing anything. A render whose key
+    plan failed raises _KeyplanIncomplete instead of returning, so the
+    degraded sheet is served once but never cached and the next click
+    retries the tiles.
+    """
+    pdf, kp_ok = _render_pdf(survey_no, village, taluk, epid, ward_no, constituency,
+                             site_length_m, site_width_m, total_builtup,
+                             roads, picked_latlon, adlr_bytes)
+    if not kp_ok:
+        raise _KeyplanIncomplete(pdf)
+    return pdf
+
+def _render_pdf(survey_no, village, taluk, epid, ward_no, constituency,
+                site_length_m, site_width_m, total_builtup,
+                roads, picked_latlon, adlr_bytes):
+    """Draw the sheet and return (pdf_bytes, keyplan_ok).
+
+    The static chrome comes pre-drawn from _template_figure(); only the
+    input-dependent artists are added here.
+    """
+    plt, mpatches = _mpl()
+    fig = pickle.loads(_template_figure())
+    ax = fig.axes[0]
+
+    # Start the network-bound key-plan build first so it overlaps all the
+    # drawing below; the future is joined right before imshow.
+    kimg_future = None
+    if picked_latlon:
+        lat, lon = picked_latlon
+        ctx = get_script_run_ctx()
+
+        def _keyplan():
+            add_script_run_ctx(threading.current_thread(), ctx)
+            # Round the cache key so sub-metre click jitter still hits.
+            return make_keyplan_image(round(lat, 5), round(lon, 5), zoom=kp_zoom)
+
+        _kp_ex = ThreadPoolExecutor(max_workers=1)
+        kimg_future = _kp_ex.submit(_keyplan)
+        _kp_ex.shutdown(wait=False)
+
+    site_x, site_y, site_w_mm, site_h_mm = _fit_site(site_length_m,
+                                                     site_width_m, roads)
+
+    # Site rectangle
+    ax.add_patch(
+        mpatches.Rectangle(
+            (site_x, site_y), site_w_mm, site_h_mm,
+            fill=False, lw=LW_SITE, linestyle=(0, (16,5,4,5,4,5))
+        )
+    )
+
+    # Roads
+    for side, has_road, w_m in roads:
+        if not has_road: continue
+        road_band = w_m * mm_per_m
+        if side == "north":
+            rx, ry, rw, rh = site_x, site_y + site_h_mm, site_w_mm, road_band
+            rot, txtx, txty = 0, rx+rw/2, ry+rh/2
+        elif side == "south":
+            rx, ry, rw, rh = site_x, site_y - road_band, site_w_mm, road_band
+            rot, txtx, txty = 0, rx+rw/2, ry+rh/2
+        elif side == "east":
+            rx, ry, rw, rh = site_x + site_w_mm, site_y, road_band, site_h_mm
+            rot, txtx, txty = 90, rx+rw/2, ry+rh/2
+        elif side == "west":
+            rx, ry, rw, rh = site_x - road_band, site_y, road_band, site_h_mm
+            rot, txtx, txty = 90, rx+rw/2, ry+rh/2
+        ax.add_patch(
+            mpatches.Rectangle((rx, ry), rw, rh, facecolor="#e0e0e0",
+                               edgecolor="black", lw=0.4, hatch="////")
+        )
+        # Just outside the band; must stay within the fit's LABEL_ALLOW.
+        if side == "north": txty += road_band/2 + LABEL_OFFSET
+        elif side == "south": txty -= road_band/2 + LABEL_OFFSET
+        elif side == "east": txtx += road_band/2 + LABEL_OFFSET
+        elif side == "west": txtx -= road_band/2 + LABEL_OFFSET
+        ax.text(txtx, txty,
+                f"{side.title()} ({w_m:.1f} m ROAD)",
+                ha="center", va="center", fontsize=F_BODY, rotation=rot)
+
+    # Site label (centred in the plot, clear of any north road band)
+    ax.text(site_x + site_w_mm/2, site_y + site_h_mm/2,
+            f"SITE (SY.NO. {survey_no})",
+            ha="center", va="center", fontsize=F_TITLE, weight="bold")
+
+    # --- KEY PLAN image ---
+    kp_ok = True
+    if kimg_future is not None:
+        try:
+            kimg = kimg_future.result()
+            # No pre-upsample: matplotlib resamples once at save time.
+            ax.imshow(kimg, extent=(key_x+1, key_x+key_w-1, key_y+1, key_y+key_h-1),
+                      interpolation="lanczos", rasterized=True)
+            # Vector site marker over the basemap (same squeeze into the
+            # key box as the image itself).
+            fx, fy, fr = keyplan_marker(round(lat, 5), round(lon, 5),
+                                        kp_zoom, kp_radius_m)
+            mx = key_x + 1 + fx * (key_w - 2)
+            my = key_y + key_h - 1 - fy * (key_h - 2)
+            ax.add_patch(mpatches.Ellipse((mx, my), 2*fr*(key_w - 2), 2*fr*(key_h - 2),
+                                          fill=False, edgecolor="#c80000", lw=1.4))
+            ax.add_patch(mpatches.Circle((mx, my), 0.8, color="black"))
+        except Exception:
+            kp_ok = False
+            ax.text(key_x + key_w/2, key_y + key_h/2,
+                "Key Plan (Error loading map)", ha="center", va="center",
+                fontsize=F_BODY, style="italic", color="red")
+    else:
+        ax.text(key_x + key_w/2, key_y + key_h/2,
+            "KEY PLAN (To be inserted here)",
+            ha="center", va="center", fontsize=F_BODY, style="italic", color="gray")
+
+    # --- ADLR SKETCH image ---
+    if adlr_bytes:
+        adlr_img = Image.open(io.BytesIO(adlr_bytes)).convert("RGB")
+        adlr_img.thumbnail((adlr_w*5, adlr_h*5))
+        ax.imshow(adlr_img, extent=(adlr_x+1, adlr_x+adlr_w-1, adlr_y+1, adlr_y+adlr_h-1),
+                  rasterized=True)
+    else:
+        ax.text(adlr_x + adlr_w/2, adlr_y + adlr_h/2,
+                "ADLR SKETCH (To be inserted here)", ha="center", va="center",
+                fontsize=F_BODY, style="italic", color="gray")
+
+    # --- LAND USE ANALYSIS table: one Table artist instead of 12 Text
+    # artists plus a frame ---
+    site_area = f"{site_width_m*site_length_m:.1f}"
+    rows = [
+        ["1", "SITE AREA", site_area, "100.00"],
+        ["2", "TOTAL SITE AREA", site_area, "100.00"]
+    ]
+    tbl = ax.table(cellText=[headers] + rows,
+                   colWidths=[w/sum(col_w) for w in col_w], cellLoc="center",
+                   bbox=[(tbl_x - 1.5)/PAGE_W_MM, (tbl_y - 3*row_h)/PAGE_H_MM,
+                         (sum(col_w) + 3)/PAGE_W_MM, 3.2*row_h/PAGE_H_MM])
+    tbl.auto_set_font_size(False)
+    tbl.set_fontsize(F_COND)
+    for (r, c), cell in tbl.get_celld().items():
+        cell.set_linewidth(0.25)
+        if r == 0:
+            cell.set_text_props(weight="bold")
+
+    # --- TITLE BLOCK values ---
+    ax.text(tb_x+6, tb_y+tb_h-19, f"TOTAL BUILT-UP AREA : {total_builtup:.2f} Sq.m", fontsize=F_COND)
+    ax.text(tb_x+6, tb_y+tb_h-25, f"SY. NO. : {survey_no}", fontsize=F_COND)
+    ax.text(dv1+6, tb_y+tb_h-7, f"VILLAGE : {village}", fontsize=F_COND)
+    ax.text(dv1+6, tb_y+tb_h-13, f"TALUK : {taluk}", fontsize=F_COND)
+    ax.text(dv1+6, tb_y+tb_h-19, f"EPID : {epid}", fontsize=F_COND)
+    ax.text(dv2+6, tb_y+tb_h-25, f"WARD NO. : {ward_no}    CONSTITUENCY : {constituency}", fontsize=F_COND)
+
+    # --- Export PDF ---
+    pdf_buf = io.BytesIO()
+    # dpi only affects rasterized artists (the two embedded images); text
+    # and linework stay vector. 200 dpi over the ~11 cm key box is plenty
+    # for print and keeps the file small.
+    fig.savefig(pdf_buf, format="pdf", dpi=200,
+                metadata={"Title": f"Single Site Plan - SY.NO. {survey_no}"})
+    plt.close(fig)
+    return pdf_buf.getvalue(), kp_ok
+
+show_preview = st.checkbox("Show preview after generating", value=True)
+
+if st.button("📄 Generate A3 PDF"):
+    roads = tuple((side, info["exists"], info["width"]) for side, info in road_info.items())
+    adlr_bytes = adlr_file.getvalue() if adlr_file else None
+    try:
+        pdf_bytes = build_pdf(survey_no, village, taluk, epid, ward_no, constituency,
+                              site_length_m, site_width_m, total_builtup,
+                              roads, picked_latlon, adlr_bytes)
+    except _KeyplanIncomplete as e:
+        pdf_bytes = e.pdf
+        st.warning("Key plan tiles could not be loaded; this sheet was "
+                   "generated without the map and won't be cached - "
+                   "generate again to retry.")
+    st.download_button("⬇️ Download A3 PDF", data=pdf_bytes,
+                       file_name=f"Single_Site_{survey_no or 'site'}.pdf",
+                       mime="application/pdf")
+    if show_preview:
+        # Preview via the browser's own PDF renderer - no second
+        # rasterization of the figure on the server.
+        b64 = base64.b64encode(pdf_bytes).decode()
+        st.iframe(f"data:application/pdf;base64,{b64}", height=800)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+